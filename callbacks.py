@@ -117,12 +117,13 @@ class EarlyStopping(Callback):
     '''
     def __init__(self, model, monitor='val_loss', patience=0, verbose=0, mode='auto'):
         '''
+        @param model: object whose `stop_training` flag is set to stop, i.e. the Trainer.
         @param monitor: str. Quantity to monitor.
         @param patience: number of epochs with no improvement after which training will be stopped.
         @param verbose: verbosity mode, 0 or 1.
         @param mode: one of {auto, min, max}. Decides if the monitored quantity improves. If set to `max`, increase of the quantity indicates improvement, and vice versa. If set to 'auto', behaves like 'max' if `monitor` contains substring 'acc'. Otherwise, behaves like 'min'.
         '''
-        super(Callback, self).__init__()
+        super(EarlyStopping, self).__init__(model)
 
         self.monitor = monitor
         self.patience = patience
@@ -136,17 +137,17 @@ class EarlyStopping(Callback):
 
         if mode == 'min':
             self.monitor_op = np.less
-            self.best = np.Inf
+            self.best = np.inf
         elif mode == 'max':
             self.monitor_op = np.greater
-            self.best = -np.Inf
+            self.best = -np.inf
         else:
             if 'acc' in self.monitor:
                 self.monitor_op = np.greater
-                self.best = -np.Inf
+                self.best = -np.inf
             else:
                 self.monitor_op = np.less
-                self.best = np.Inf
+                self.best = np.inf
 
     def on_epoch_end(self, epoch, logs={}):
         current = logs.get(self.monitor)
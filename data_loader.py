@@ -8,6 +8,7 @@ class MyMNIST(torchvision.datasets.MNIST):
     def __init__(self, *args, **kwargs):
         self.num_channels = 1
         self.num_class = 10
+        self.img_shape = (28, 28)
         super(MyMNIST, self).__init__(*args, **kwargs)
 
 
@@ -34,11 +35,12 @@ def get_MNIST_test_dataset(data_dir):
     )
 
 
-def get_train_val_loader(train_dataset, val_dataset, val_split=0.1, random_split=False, batch_size=32, num_workers=4, pin_memory=False):
+def get_train_val_loader(train_dataset, val_dataset, val_split=0.1, random_split=False, batch_size=32, num_workers=4, pin_memory=False, distributed=False, drop_last=False):
     """
     Utility function for loading and returning train and valid multi-process iterators over the dataset.
 
-    If using CUDA, num_workers should be set to 1 and pin_memory to True.
+    If using CUDA, pin_memory should be set to True so batches can be copied to the GPU asynchronously.
+    Workers are kept alive across epochs when num_workers > 0.
 
     @param train_dataset: A pytorch dataset for training purpose.
     @param val_dataset: A pytorch dataset for validation purpose. If None, generate from train_dataset.
@@ -48,17 +50,27 @@ def get_train_val_loader(train_dataset, val_dataset, val_split=0.1, random_split
     @param the validation set. Should be a float in the range [0, 1].
     @param num_workers: number of subprocesses to use when loading the dataset.
     @param pin_memory: whether to copy tensors into CUDA pinned memory. Set it to True if using GPU.
+    @param distributed: whether to shard the training and validation samples across processes with a DistributedSampler.
+    The process group must already be initialized. The DistributedSampler pads the shards to equal length,
+    so a few validation samples may be evaluated twice.
+    @param drop_last: whether to drop the last incomplete training batch, so that every batch has the same shape.
 
     @return A tuple containing training/validation sample iterator
     """
     if val_dataset is not None:
+        train_sampler, valid_sampler = None, None
+        if distributed:
+            train_sampler = torchutils.distributed.DistributedSampler(train_dataset)
+            valid_sampler = torchutils.distributed.DistributedSampler(val_dataset, shuffle=False)
         train_loader = torchutils.DataLoader(
-            train_dataset, batch_size=batch_size, shuffle=True,
-            num_workers=num_workers, pin_memory=pin_memory
+            train_dataset, batch_size=batch_size, shuffle=(train_sampler is None),
+            sampler=train_sampler, drop_last=drop_last, num_workers=num_workers, pin_memory=pin_memory,
+            persistent_workers=num_workers > 0
         )
         val_loader = torchutils.DataLoader(
-            val_dataset, batch_size=batch_size,
-            num_workers=num_workers, pin_memory=pin_memory
+            val_dataset, batch_size=batch_size, sampler=valid_sampler,
+            num_workers=num_workers, pin_memory=pin_memory,
+            persistent_workers=num_workers > 0
         )
         return (train_loader, val_loader)
     else:
@@ -71,18 +83,35 @@ def get_train_val_loader(train_dataset, val_dataset, val_split=0.1, random_split
 
         train_idx, valid_idx = indices[split:], indices[:split]
 
-        train_sampler = torchutils.sampler.SubsetRandomSampler(train_idx)
-        valid_sampler = torchutils.sampler.SubsetRandomSampler(valid_idx)
-
-        train_loader = torchutils.DataLoader(
-            train_dataset, batch_size=batch_size, sampler=train_sampler,
-            num_workers=num_workers, pin_memory=pin_memory,
-        )
-
-        val_loader = torchutils.DataLoader(
-            train_dataset, batch_size=batch_size, sampler=valid_sampler,
-            num_workers=num_workers, pin_memory=pin_memory,
-        )
+        if distributed:
+            # shard the training and the validation indices separately
+            train_subset = torchutils.Subset(train_dataset, train_idx)
+            valid_subset = torchutils.Subset(train_dataset, valid_idx)
+            train_sampler = torchutils.distributed.DistributedSampler(train_subset)
+            valid_sampler = torchutils.distributed.DistributedSampler(valid_subset, shuffle=False)
+            train_loader = torchutils.DataLoader(
+                train_subset, batch_size=batch_size, sampler=train_sampler, drop_last=drop_last,
+                num_workers=num_workers, pin_memory=pin_memory,
+                persistent_workers=num_workers > 0,
+            )
+            val_loader = torchutils.DataLoader(
+                valid_subset, batch_size=batch_size, sampler=valid_sampler,
+                num_workers=num_workers, pin_memory=pin_memory,
+                persistent_workers=num_workers > 0,
+            )
+        else:
+            train_sampler = torchutils.sampler.SubsetRandomSampler(train_idx)
+            valid_sampler = torchutils.sampler.SubsetRandomSampler(valid_idx)
+            train_loader = torchutils.DataLoader(
+                train_dataset, batch_size=batch_size, sampler=train_sampler, drop_last=drop_last,
+                num_workers=num_workers, pin_memory=pin_memory,
+                persistent_workers=num_workers > 0,
+            )
+            val_loader = torchutils.DataLoader(
+                train_dataset, batch_size=batch_size, sampler=valid_sampler,
+                num_workers=num_workers, pin_memory=pin_memory,
+                persistent_workers=num_workers > 0,
+            )
         return (train_loader, val_loader)
 
 
@@ -93,7 +122,8 @@ def get_test_loader(test_dataset,
     """
     Utility function for loading and returning a multi-process test iterator over the dataset.
 
-    If using CUDA, num_workers should be set to 1 and pin_memory to True.
+    If using CUDA, pin_memory should be set to True so batches can be copied to the GPU asynchronously.
+    Workers are kept alive across epochs when num_workers > 0.
     @param test_dataset: A pytorch dataset for testing purpose.
     @param batch_size: how many samples per batch to load.
     @param num_workers: number of subprocesses to use when loading the dataset.
@@ -103,5 +133,6 @@ def get_test_loader(test_dataset,
     @return A test sample iterator.
     """
     data_loader = torchutils.DataLoader(
-        test_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=pin_memory)
+        test_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=pin_memory,
+        persistent_workers=num_workers > 0)
     return data_loader
@@ -46,6 +46,8 @@ def parse_args():
     train_arg.add_argument('--is_train', type=str2bool, default=True, help='Whether to train or test the model')
     train_arg.add_argument('--batch_size', type=int, default=32, help='# of images in each batch of data')
     train_arg.add_argument('--epochs', type=int, default=200, help='# of epochs to train for')
+    train_arg.add_argument('--distributed', type=str2bool, default=False, help='Whether to train on multiple GPUs with DistributedDataParallel (launch with torchrun)')
+    train_arg.add_argument('--amp', type=str2bool, default=False, help='Whether to train in bfloat16 mixed precision (GPU only)')
     train_arg.add_argument('--patience', type=int, default=100, help='Max # of epochs to wait for no validation improv')
 
     train_arg.add_argument('--momentum', type=float, default=0.5, help='Nesterov momentum value')
@@ -55,6 +57,7 @@ def parse_args():
     # other params
     misc_arg = parser.add_argument_group('Misc.')
     misc_arg.add_argument('--use_gpu', type=str2bool, default=False, help="Whether to run on the GPU")
+    misc_arg.add_argument('--compile', type=str2bool, default=False, help='Whether to compile the glimpse step with torch.compile')
     misc_arg.add_argument('--best', type=str2bool, default=True, help='Load best model or most recent for testing')
     misc_arg.add_argument('--random_seed', type=int, default=1, help='Seed to ensure reproducibility')
     misc_arg.add_argument('--data_dir', default='./data', help='Directory in which data is stored')
@@ -65,14 +68,20 @@ def parse_args():
     misc_arg.add_argument('--print_freq', type=int, default=10, help='How frequently to print training details')
     misc_arg.add_argument('--plot_freq', type=int, default=1, help='How frequently to plot glimpses')
     misc_arg.add_argument('--plot_num_imgs', type=int, default=6, help='How many imgs to plot glimpses animiation')
-    return parser.parse_args(sys.argv[1:])
+    args = parser.parse_args(sys.argv[1:])
+    if args.distributed and not args.use_gpu:
+        parser.error('--distributed=True requires --use_gpu=True')
+    if args.amp and not args.use_gpu:
+        parser.error('--amp=True requires --use_gpu=True')
+    return args
 
 
 def load_checkpoint(ckpt_dir, model, optimizer, best=False):
+    # same file names as the ModelCheckpoint callback
+    ckpt_path = os.path.join(ckpt_dir, model.name + '_ckpt')
     if best:
-        ckpt = torch.load(os.path.join(ckpt_dir, model.name))
-    else:
-        ckpt = torch.load(os.path.join(ckpt_dir, model.name+'_best'))
+        ckpt_path += '_best'
+    ckpt = torch.load(ckpt_path)
 
     model.load_state_dict(ckpt['model_state_dict'])
     if optimizer:
@@ -93,10 +102,15 @@ if __name__ == '__main__':
     torch.manual_seed(args.random_seed)
     random.seed(args.random_seed)
     np.random.seed(args.random_seed)
+    if args.distributed:
+        # one process per GPU, LOCAL_RANK is set by torchrun
+        torch.cuda.set_device(int(os.environ['LOCAL_RANK']))
+        torch.distributed.init_process_group('nccl')
+
     kwargs = {}
     if args.use_gpu:
         torch.cuda.manual_seed(args.random_seed)
-        kwargs = {'num_workers': 1, 'pin_memory': True}
+        kwargs = {'num_workers': args.num_workers, 'pin_memory': True}
 
     if args.is_train:
         train_dataset, val_dataset = get_MNIST_train_val_dataset(args.data_dir)
@@ -106,16 +120,20 @@ if __name__ == '__main__':
             val_split=args.val_split,
             random_split=args.random_split,
             batch_size=args.batch_size,
+            distributed=args.distributed,
+            drop_last=args.compile,
             **kwargs
         )
-        args.num_class = train_loader.dataset.num_class
-        args.num_channels = train_loader.dataset.num_channels
+        args.num_class = train_dataset.num_class
+        args.num_channels = train_dataset.num_channels
+        args.img_shape = train_dataset.img_shape
 
     else:
         test_dataset = get_MNIST_test_dataset(args.data_dir)
         test_loader = get_test_loader(test_dataset, args.batch_size, **kwargs)
         args.num_class = test_loader.dataset.num_class
         args.num_channels = test_loader.dataset.num_channels
+        args.img_shape = test_loader.dataset.img_shape
 
     # build RAM model
     model = RecurrentAttention(args)
@@ -125,7 +143,7 @@ if __name__ == '__main__':
 
     logger.info('Number of model parameters: {:,}'.format(
         sum([p.data.nelement() for p in model.parameters()])))
-    trainer = Trainer(model, optimizer, watch=['acc'], val_watch=['acc'])
+    trainer = Trainer(model, optimizer, watch=['acc'], val_watch=['acc'], distributed=args.distributed, amp=args.amp)
 
     if args.is_train:
         logger.info("Train on {} samples, validate on {} samples".format(len(train_loader.dataset), len(val_loader.dataset)))
@@ -133,17 +151,24 @@ if __name__ == '__main__':
         if args.resume:
             start_epoch = load_checkpoint(args.ckpt_dir, model, optimizer)
 
+        # every process must take the same lr and stopping decisions,
+        # the callbacks writing files only run on the rank 0 process.
+        callbacks = [
+            LearningRateScheduler(ReduceLROnPlateau(optimizer, 'min'), 'val_loss'),
+            EarlyStopping(trainer, patience=args.patience)
+        ]
+        if trainer.is_master:
+            callbacks = [
+                PlotCbk(model, args.plot_num_imgs, args.plot_freq, args.use_gpu),
+                TensorBoard(model, args.log_dir),
+                ModelCheckpoint(model, optimizer, args.ckpt_dir)
+            ] + callbacks
+
         trainer.train(train_loader, val_loader,
                       start_epoch=start_epoch,
                       epochs=args.epochs,
-                      callbacks=[
-                          PlotCbk(model, args.plot_num_imgs, args.plot_freq, args.use_gpu),
-                          TensorBoard(model, args.log_dir),
-                          ModelCheckpoint(model, optimizer, args.ckpt_dir),
-                          LearningRateScheduler(ReduceLROnPlateau(optimizer, 'min'), 'val_loss'),
-                          EarlyStopping(model, patience=args.patience)
-                      ])
+                      callbacks=callbacks)
     else:
-        logger.info("Test on {} samples".format((len(test_loader))))
-        load_checkpoint(args.ckpt_dir, model, best=True)
-        trainer.test(test_loader, best=args.best)
+        logger.info("Test on {} samples".format((len(test_loader.dataset))))
+        load_checkpoint(args.ckpt_dir, model, None, best=args.best)
+        trainer.test(test_loader)
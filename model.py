@@ -1,4 +1,3 @@
-from torch.autograd import Variable
 import torch.nn.functional as F
 
 import torch
@@ -22,9 +21,8 @@ class RecurrentAttention(nn.Module):
         self.name = 'ram_{}_{}x{}_{}'.format(args.num_glimpses, args.patch_size, args.patch_size, args.glimpse_scale)
 
     def init_loc(self, batch_size):
-        dtype = torch.cuda.FloatTensor if self.use_gpu else torch.FloatTensor
-        l_t = torch.Tensor(batch_size, 2).uniform_(-1, 1)
-        l_t = Variable(l_t).type(dtype)
+        device = torch.device('cuda' if self.use_gpu else 'cpu')
+        l_t = torch.empty(batch_size, 2, device=device).uniform_(-1, 1)
         return l_t
 
     def forward(self, x, y, is_training=False):
@@ -32,9 +30,9 @@ class RecurrentAttention(nn.Module):
         @param x: image. (batch, channel, height, width)
         @param y: word indices. (batch, seq_len)
         """
+        # asynchronous copy, overlapped with compute when the batch is in pinned memory
         if self.use_gpu:
-            x, y = x.cuda(), y.cuda()
-        x, y = Variable(x), Variable(y)
+            x, y = x.cuda(non_blocking=True), y.cuda(non_blocking=True)
 
         if not is_training:
             return self.forward_test(x, y)
@@ -3,93 +3,80 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions import Normal
 
-from torch.autograd import Variable
 
-import numpy as np
-
-
-class retina(object):
-    def __init__(self, patch_size, num_patches, scale, use_gpu):
+class retina(nn.Module):
+    def __init__(self, patch_size, num_patches, scale, img_shape):
         """
         @param patch_size: side length of the extracted patched.
         @param num_patches: number of patches to extract in the glimpse.
         @param scale: scaling factor that controls the size of successive patches.
+        @param img_shape: (height, width) of the input images.
         """
+        super(retina, self).__init__()
         self.patch_size = patch_size
         self.num_patches = num_patches
         self.scale = scale
-        self.use_gpu = use_gpu
+        self.img_shape = tuple(img_shape)
+
+        # side length of each of the num_patches patches
+        self.sizes = [int(scale**i * patch_size) for i in range(num_patches)]
+
+        # As buffers they follow the module onto the same device as `x`.
+        # imgShape: (width, height) of the input images, same order as `l`.
+        # zoom: (num_patches, 2), size of each patch relative to the image.
+        H, W = img_shape
+        self.register_buffer('imgShape', torch.tensor([W, H]).float(), persistent=False)
+        self.register_buffer('zoom', torch.tensor(self.sizes).float().unsqueeze(1) / self.imgShape, persistent=False)
 
     def foveate(self, x, l):
         """
         Extract `num_patches` square patches,  centered at location `l`.
         The initial patch is a square of sidelength `patch_size`,
         and each subsequent patch is a square whose sidelength is `scale`
-        times the size of the previous patch.  All patches are finally
-        resized to the same size of the first patch and then flattened.
+        times the size of the previous patch.  All patches are
+        sampled directly at the size of the first patch and then flattened.
+
+        The larger patches are point sampled with bilinear interpolation,
+        not averaged: each output pixel only blends the 2x2 pixels closest
+        to the centre of its block. This matches average pooling for a 2x
+        patch but aliases the coarser scales. Locations are not rounded to
+        the pixel grid, sub-pixel locations are interpolated as well.
 
-        @param x: img. (batch, height, width, channel)
+        @param x: img. (batch, channel, height, width)
         @param l: location. (batch,2)
-        @return Variable: (batch, num_patches*channel*patch_size*patch_size).
+        @return patches: (batch, channel*num_patches*patch_size*patch_size).
         """
-        patches = []
-        size = self.patch_size
-
-        # extract num_patches patches of increasing size
-        for i in range(self.num_patches):
-            patches.append(self.extract_patch(x, l, size))
-            size = int(self.scale * size)
-
-        # resize the patches to squares of size patch_size
-        for i in range(1, len(patches)):
-            num_patches = patches[i].shape[-1] // self.patch_size
-            patches[i] = F.avg_pool2d(patches[i], num_patches)
-
-        # concatenate into a single tensor and flatten
-        patches = torch.cat(patches, 1)
-        patches = patches.view(patches.shape[0], -1)
+        assert tuple(x.shape[-2:]) == self.img_shape, \
+            'retina built for {} images, got {}'.format(self.img_shape, tuple(x.shape[-2:]))
+        B, C = x.shape[:2]
+        K, P = self.num_patches, self.patch_size
+
+        # affine transforms mapping each output patch onto the image:
+        # zoom the sampling grid to the patch size and centre it at `l`.
+        # `l` is already in the [-1, 1] normalized coordinates of grid_sample,
+        # out of bounds pixels are sampled as 0s (same as zero padding).
+        # theta: (batch, num_patches, 2, 3)
+        theta = x.new_zeros(B, K, 2, 3)
+        theta[:, :, 0, 0] = self.zoom[:, 0]
+        theta[:, :, 1, 1] = self.zoom[:, 1]
+        theta[:, :, :, 2] = l.unsqueeze(1)
+
+        # sample every scale on a patch_size grid (no low-pass filter, see
+        # above). Stack the grids of all the scales along the height,
+        # so every patch of the batch is sampled in a single pass over `x`.
+        grid = F.affine_grid(theta.view(B*K, 2, 3), (B*K, C, P, P), align_corners=False)
+        grid = grid.view(B, K*P, P, 2)
+        patches = F.grid_sample(x, grid, padding_mode='zeros', align_corners=False)
+
+        # the sampled patches are already laid out contiguously as
+        # (batch, channel, num_patches*patch_size, patch_size), flatten as is
+        patches = patches.view(B, -1)
 
         return patches
 
-    def extract_patch(self, x, l, size):
-        """
-        @param x: img. (batch, height, width, channel)
-        @param l: location. (batch, 2)
-        @param size: the size of the extracted patch.
-        @return Variable (batch, height, width, channel)
-        """
-        B, C, H, W = x.shape
-
-        if not hasattr(self, 'imgShape'):
-            self.imgShape = torch.FloatTensor([H, W]).unsqueeze(0)
-            if self.use_gpu:
-                self.imgShape = self.imgShape.cuda()
-
-        # coordins from [-1,1] to H,W scale
-        coords = (0.5 * ((l.data + 1.0) * self.imgShape)).long()
-
-        # pad the image with enough 0s
-        x = nn.ConstantPad2d(size//2, 0.)(x)
-
-        # calculate coordinate for each batch samle (padding considered)
-        from_x, from_y = coords[:, 0], coords[:, 1]
-        to_x, to_y = from_x + size, from_y + size
-        # The above is the original implementation
-        # It only works if the input image is a square
-        # The following is the correct implementation
-        # from_y, from_x = coords[:, 0], coords[:, 1]
-        # to_y, to_x = from_y + size, from_x + size
-
-        # extract the patches
-        patch = []
-        for i in range(B):
-            patch.append(x[i, :, from_y[i]:to_y[i], from_x[i]:to_x[i]].unsqueeze(0))
-
-        return torch.cat(patch)
-
 
 class GlimpseNet(nn.Module):
-    def __init__(self, hidden_g, hidden_l, patch_size, num_patches, scale, num_channel, use_gpu):
+    def __init__(self, hidden_g, hidden_l, patch_size, num_patches, scale, num_channel, img_shape):
         """
         @param hidden_g: hidden layer size of the fc layer for `phi`.
         @param hidden_l: hidden layer size of the fc layer for `l`.
@@ -98,9 +85,12 @@ class GlimpseNet(nn.Module):
         @param num_patches: number of patches to extract per glimpse.
         @param scale: scaling factor that controls the size of successive patches.
         @param num_channel: number of channels in each image.
+        @param img_shape: (height, width) of each image.
         """
         super(GlimpseNet, self).__init__()
-        self.retina = retina(patch_size, num_patches, scale, use_gpu)
+        self.num_patches = num_patches
+        self.num_channel = num_channel
+        self.retina = retina(patch_size, num_patches, scale, img_shape)
 
         # glimpse layer
         D_in = num_patches*patch_size*patch_size*num_channel
@@ -109,8 +99,8 @@ class GlimpseNet(nn.Module):
         # location layer
         self.fc2 = nn.Linear(2, hidden_l)
 
-        self.fc3 = nn.Linear(hidden_g, hidden_g+hidden_l)
-        self.fc4 = nn.Linear(hidden_l, hidden_g+hidden_l)
+        # fc(what) + fc(where) as a single fc over [what, where]
+        self.fc_out = nn.Linear(hidden_g+hidden_l, hidden_g+hidden_l)
 
     def forward(self, x_t, l_t):
         """
@@ -122,13 +112,28 @@ class GlimpseNet(nn.Module):
         """
         glimpse = self.retina.foveate(x_t, l_t)
 
-        what = self.fc3(F.relu(self.fc1(glimpse)))
-        where = self.fc4(F.relu(self.fc2(l_t)))
+        what = F.relu(self.fc1(glimpse))
+        where = F.relu(self.fc2(l_t))
 
-        g = F.relu(what + where)
+        g = F.relu(self.fc_out(torch.cat([what, where], 1)))
 
         return g
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints saved with separate fc3 and fc4 layers, which also
+        # flattened the glimpse in (num_patches, channel) order
+        if prefix + 'fc3.weight' in state_dict:
+            fc3_w, fc3_b = state_dict.pop(prefix + 'fc3.weight'), state_dict.pop(prefix + 'fc3.bias')
+            fc4_w, fc4_b = state_dict.pop(prefix + 'fc4.weight'), state_dict.pop(prefix + 'fc4.bias')
+            state_dict[prefix + 'fc_out.weight'] = torch.cat([fc3_w, fc4_w], 1)
+            state_dict[prefix + 'fc_out.bias'] = fc3_b + fc4_b
+
+            # reorder the fc1 inputs to the (channel, num_patches) glimpse layout
+            fc1_w = state_dict[prefix + 'fc1.weight']
+            fc1_w = fc1_w.view(fc1_w.shape[0], self.num_patches, self.num_channel, -1).transpose(1, 2)
+            state_dict[prefix + 'fc1.weight'] = fc1_w.reshape(fc1_w.shape[0], -1)
+        super(GlimpseNet, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
 
 class core_network(nn.Module):
     """
@@ -166,15 +171,22 @@ class core_network(nn.Module):
         self.rnn_hidden = rnn_hidden
         self.use_gpu = use_gpu
 
-        self.i2h = nn.Linear(input_size, rnn_hidden)
-        self.h2h = nn.Linear(rnn_hidden, rnn_hidden)
+        # fc(h_t_prev) + fc(g_t) as a single fc over [g_t, h_t_prev]
+        self.ih = nn.Linear(input_size + rnn_hidden, rnn_hidden)
 
     def forward(self, g_t, h_t_prev):
-        h1 = self.i2h(g_t)
-        h2 = self.h2h(h_t_prev)
-        h_t = F.relu(h1 + h2)
+        h_t = F.relu(self.ih(torch.cat([g_t, h_t_prev], dim=1)))
         return h_t
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints saved with separate i2h and h2h layers
+        if prefix + 'i2h.weight' in state_dict:
+            i2h_w, i2h_b = state_dict.pop(prefix + 'i2h.weight'), state_dict.pop(prefix + 'i2h.bias')
+            h2h_w, h2h_b = state_dict.pop(prefix + 'h2h.weight'), state_dict.pop(prefix + 'h2h.bias')
+            state_dict[prefix + 'ih.weight'] = torch.cat([i2h_w, h2h_w], 1)
+            state_dict[prefix + 'ih.bias'] = i2h_b + h2h_b
+        super(core_network, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def init_hidden(self, batch_size, use_gpu=False):
         """
         Initialize the hidden state of the core network
@@ -183,9 +195,8 @@ class core_network(nn.Module):
         This is called once every time a new minibatch
         `x` is introduced.
         """
-        dtype = torch.cuda.FloatTensor if self.use_gpu else torch.FloatTensor
-        h_t = torch.zeros(batch_size, self.rnn_hidden)
-        h_t = Variable(h_t).type(dtype)
+        device = torch.device('cuda' if self.use_gpu else 'cpu')
+        h_t = torch.zeros(batch_size, self.rnn_hidden, device=device)
 
         return h_t
 
@@ -230,23 +241,18 @@ class LocationNet(nn.Module):
                     reinforce loss. (B, 2).
         @return l_t: Next location. (B, 2).
         """
-        # compute noise-free location
-        mu = F.tanh(self.fc(h_t))
-
-        # sample from gaussian parametrized by this mean
-        # This is the origin repo implementation
-        noise = torch.from_numpy(np.random.normal(
-            scale=self.std, size=mu.shape)
-        )
-        noise = Variable(noise.float()).type_as(mu)
+        # the location sampling stays in float32 under mixed precision,
+        # the noise is small compared to the bfloat16 resolution.
+        with torch.autocast(h_t.device.type, enabled=False):
+            # compute noise-free location
+            mu = torch.tanh(self.fc(h_t.float()))
 
-        # This is an equivalent implementation
-        # noise = torch.zeros_like(mu)
-        # noise.data.normal_(std=self.std)
+            # sample from gaussian parametrized by this mean
+            noise = torch.empty_like(mu).normal_(0, self.std)
 
-        # add noise to the location and bound between [-1, 1]
-        l_t = mu + noise
-        l_t = F.tanh(l_t)
+            # add noise to the location and bound between [-1, 1]
+            l_t = mu + noise
+            l_t = torch.tanh(l_t)
 
         # prevent gradient flow
         # Note that l_t is not used to calculate gradients later.
@@ -292,56 +298,71 @@ class RAMNet(nn.Module):
         self.num_glimpses = args.num_glimpses
         self.std = args.std
 
-        self.glimpse_net = GlimpseNet(args.glimpse_hidden, args.loc_hidden, args.patch_size, args.num_patches, args.glimpse_scale, args.num_channels, args.use_gpu)
+        self.glimpse_net = GlimpseNet(args.glimpse_hidden, args.loc_hidden, args.patch_size, args.num_patches, args.glimpse_scale, args.num_channels, args.img_shape)
         self.rnn = core_network(rnn_inp_size, args.rnn_hidden, args.use_gpu)
         self.location_net = LocationNet(args.rnn_hidden, 2, args.std)
         self.classifier = ActionNet(args.rnn_hidden, args.num_class)
         self.baseline_net = BaselineNet(args.rnn_hidden, 1)
 
+        # compile the glimpse step, specialized to the fixed input shape, to fuse
+        # the small networks and cut the python dispatch overhead. The glimpse
+        # loop itself stays in python, the step is compiled once instead of
+        # num_glimpses times. No CUDA graphs ('reduce-overhead'): forward keeps
+        # the outputs of every step, which a graph replay would overwrite.
+        # Only the bound method is wrapped, the state dict keys are unchanged.
+        if args.compile:
+            self.step = torch.compile(self.step, dynamic=False)
+
     def step(self, x, l_t, h_t):
         """
+        Only the recurrent part of a glimpse step: the next location depends
+        on the new hidden state, everything else is computed in `forward`.
+
         @param x: image. (batch, channel, height, width)
         @param l_t: location trial. (batch, 2)
         @param h_t: last hidden state. (batch, rnn_hidden)
         @return h_t: next hidden state. (batch, rnn_hidden)
+        @return mu: noise free next location. (batch, 2)
         @return l_t: next location trial. (batch, 2)
-        @return b_t: baseline for step t. (batch)
-        @return log_pi: probability for next location trial. (batch)
         """
         glimpse = self.glimpse_net(x, l_t)
         h_t = self.rnn(glimpse, h_t)
         mu, l_t = self.location_net(h_t)
-        b_t = self.baseline_net(h_t).squeeze()
-
-        log_pi = Normal(mu, self.std).log_prob(l_t)
-        # Note: log(p_y*p_x) = log(p_y) + log(p_x)
-        log_pi = log_pi.sum(dim=1)
 
-        return h_t, l_t, b_t, log_pi
+        return h_t, mu, l_t
 
     def forward(self, x, l_t):
         """
         @param x: image. (batch, channel, height, width)
         @param l_t: initial location. (batch, 2)
 
-        @return hiddens: hidden states (output) of rnn. (batch, num_glimpses, rnn_hidden)
         @return locs: locations. (batch, 2)*num_glimpses
         @return baselines: (batch, num_glimpses)
         @return log_pi: probabilities for each location trial. (batch, num_glimpses)
+        @return log_probas: (batch, num_class)
         """
         batch_size = x.shape[0]
         h_t = self.rnn.init_hidden(batch_size)
 
+        hiddens = []
+        mus = []
         locs = []
-        baselines = []
-        log_pi = []
         for t in range(self.num_glimpses):
-            h_t, l_t, b_t, p_t = self.step(x, l_t, h_t)
+            h_t, mu, l_t = self.step(x, l_t, h_t)
+            hiddens.append(h_t)
+            mus.append(mu)
             locs.append(l_t)
-            baselines.append(b_t)
-            log_pi.append(p_t)
+
+        # the non recurrent heads run once over all the glimpses
+        # hiddens:  (num_glimpses, batch, rnn_hidden)
+        # mus:      (num_glimpses, batch, 2)
+        hiddens = torch.stack(hiddens)
+        mus = torch.stack(mus)
 
         log_probas = self.classifier(h_t)
-        baselines = torch.stack(baselines).transpose(1, 0)
-        log_pi = torch.stack(log_pi).transpose(1, 0)
+        baselines = self.baseline_net(hiddens).squeeze(2).transpose(1, 0)
+
+        log_pi = Normal(mus, self.std).log_prob(torch.stack(locs))
+        # Note: log(p_y*p_x) = log(p_y) + log(p_x)
+        log_pi = log_pi.sum(dim=2).transpose(1, 0)
         return locs, baselines, log_pi, log_probas
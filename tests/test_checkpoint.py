@@ -0,0 +1,53 @@
+import os
+import sys
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root_dir)
+
+import torch
+import torch.nn.functional as F
+
+from modules import core_network, GlimpseNet
+from test_retina import baseline_foveate
+
+
+def test_core_network_loads_split_layers():
+    """
+    A checkpoint with the separate i2h and h2h layers loads into the fused
+    layer and computes the same `h_t = relu( fc(h_t_prev) + fc(g_t) )`.
+    """
+    torch.manual_seed(0)
+    old = {'i2h.weight': torch.randn(6, 4), 'i2h.bias': torch.randn(6),
+           'h2h.weight': torch.randn(6, 6), 'h2h.bias': torch.randn(6)}
+    g_t, h_t_prev = torch.randn(3, 4), torch.randn(3, 6)
+    expected = F.relu(F.linear(g_t, old['i2h.weight'], old['i2h.bias']) +
+                      F.linear(h_t_prev, old['h2h.weight'], old['h2h.bias']))
+
+    rnn = core_network(4, 6, use_gpu=False)
+    rnn.load_state_dict(old)
+    assert torch.allclose(rnn(g_t, h_t_prev), expected, atol=1e-6)
+
+
+def test_glimpse_net_loads_split_layers():
+    """
+    A checkpoint from the baseline GlimpseNet (fc3 and fc4 layers, glimpse
+    flattened in (num_patches, channel) order) gives the same features.
+    At pixel aligned locations the first two retina scales match the
+    baseline exactly, see test_retina.py.
+    """
+    torch.manual_seed(0)
+    hidden_g, hidden_l, P, K, C = 5, 3, 4, 2, 3
+    old = {'fc1.weight': torch.randn(hidden_g, K*C*P*P), 'fc1.bias': torch.randn(hidden_g),
+           'fc2.weight': torch.randn(hidden_l, 2), 'fc2.bias': torch.randn(hidden_l),
+           'fc3.weight': torch.randn(hidden_g+hidden_l, hidden_g), 'fc3.bias': torch.randn(hidden_g+hidden_l),
+           'fc4.weight': torch.randn(hidden_g+hidden_l, hidden_l), 'fc4.bias': torch.randn(hidden_g+hidden_l)}
+    x = torch.rand(2, C, 32, 32)
+    l = torch.FloatTensor([[0., 0.], [-0.5, 0.25]])
+
+    glimpse = baseline_foveate(x, l, patch_size=P, num_patches=K, scale=2).reshape(2, -1)
+    what = F.linear(F.relu(F.linear(glimpse, old['fc1.weight'], old['fc1.bias'])), old['fc3.weight'], old['fc3.bias'])
+    where = F.linear(F.relu(F.linear(l, old['fc2.weight'], old['fc2.bias'])), old['fc4.weight'], old['fc4.bias'])
+    expected = F.relu(what + where)
+
+    net = GlimpseNet(hidden_g, hidden_l, P, K, 2, C, (32, 32))
+    net.load_state_dict(old)
+    assert torch.allclose(net(x, l), expected, atol=1e-5)
@@ -4,7 +4,6 @@ sys.path.append("..")
 import torch
 
 from utils import img2array
-from torch.autograd import Variable
 from model import RecurrentAttention
 
 # params
@@ -20,13 +19,12 @@ def main():
     for i in range(len(paths)):
         img = img2array(paths[i], desired_size=[512, 512], expand=True)
         imgs.append(torch.from_numpy(img))
-    imgs = Variable(torch.cat(imgs))
+    imgs = torch.cat(imgs)
 
     B, H, W, C = imgs.shape
 
     l_t_prev = torch.Tensor(B, 2).uniform_(-1, 1)
-    l_t_prev = Variable(l_t_prev)
-    h_t_prev = Variable(torch.zeros(B, 256))
+    h_t_prev = torch.zeros(B, 256)
 
     ram = RecurrentAttention(64, 3, 2, 3, 128, 128, 256, 10, 0.11)
     h_t, l_t = ram(imgs, l_t_prev, h_t_prev)
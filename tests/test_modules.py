@@ -2,7 +2,6 @@ import sys
 sys.path.append("..")
 
 import torch
-from torch.autograd import Variable
 from torch.distributions import Normal
 
 from utils import img2array
@@ -28,12 +27,11 @@ def main():
     B, H, W, C = imgs.shape
 
     loc = torch.Tensor([[-1., 1.], [-1., 1.]])
-    imgs, loc = Variable(imgs), Variable(loc)
     sensor = glimpse_network(h_g=128, h_l=128, g=64, k=3, s=2, c=3)
     g_t = sensor(imgs, loc)
 
     rnn = core_network(input_size=256, hidden_size=256)
-    h_t = Variable(torch.zeros(g_t.shape[0], 256))
+    h_t = torch.zeros(g_t.shape[0], 256)
     h_t = rnn(g_t, h_t)
 
     classifier = action_network(256, 10)
@@ -1,7 +1,10 @@
+import os
 import sys
-sys.path.append("..")
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root_dir)
 
 import torch
+import torch.nn.functional as F
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
@@ -9,15 +12,14 @@ import matplotlib.patches as patches
 from PIL import Image
 from modules import retina
 from functools import reduce
-from torch.autograd import Variable
 from utils import img2array, array2img
 
 # params
 TEST_GLIMPSE = True
 TEST_BOUNDING = True
 SAVE = False
-plot_dir = '../plots/'
-data_dir = '../data/'
+plot_dir = os.path.join(root_dir, 'plots/')
+data_dir = os.path.join(root_dir, 'data/')
 
 
 def denormalize(T, coords):
@@ -56,6 +58,55 @@ def merge_images(image1, image2):
     return result
 
 
+def baseline_foveate(x, l, patch_size, num_patches, scale):
+    """
+    The original retina, slicing each patch out of the zero padded
+    image and average pooling it down to patch_size.
+
+    Returns (batch, num_patches, channel, patch_size, patch_size).
+    """
+    B, C, H, W = x.shape
+    coords = (0.5 * ((l + 1.0) * torch.FloatTensor([[H, W]]))).long()
+    from_x, from_y = coords[:, 0], coords[:, 1]
+
+    patches = []
+    size = patch_size
+    for i in range(num_patches):
+        padded = F.pad(x, [size//2] * 4)
+        patch = torch.cat([padded[b:b+1, :, from_y[b]:from_y[b]+size, from_x[b]:from_x[b]+size] for b in range(B)])
+        patches.append(F.avg_pool2d(patch, size // patch_size))
+        size = int(scale * size)
+
+    return torch.stack(patches, 1)
+
+
+def test_foveate_matches_baseline():
+    """
+    At pixel aligned locations, including one on the border, the first
+    two scales match the original retina. The glimpse is flattened in
+    (channel, num_patches) order. Coarser scales are point sampled and
+    differ from the average pooling.
+    """
+    torch.manual_seed(0)
+    x = torch.rand(4, 2, 32, 32)
+    l = torch.FloatTensor([[0., 0.], [-0.5, 0.25], [0.375, -0.5], [-1., 0.75]])
+
+    ret = retina(patch_size=4, num_patches=2, scale=2, img_shape=(32, 32))
+    glimpse = ret.foveate(x, l).view(4, 2, 2, 4, 4)
+
+    expected = baseline_foveate(x, l, patch_size=4, num_patches=2, scale=2)
+    assert torch.allclose(glimpse, expected.transpose(1, 2), atol=1e-6)
+
+
+def test_foveate_rejects_other_image_sizes():
+    ret = retina(patch_size=4, num_patches=2, scale=2, img_shape=(32, 32))
+    try:
+        ret.foveate(torch.rand(1, 1, 28, 28), torch.zeros(1, 2))
+    except AssertionError:
+        return
+    raise AssertionError('foveate accepted a 28x28 image')
+
+
 def main():
 
     # load images
@@ -64,18 +115,18 @@ def main():
     for i in range(len(paths)):
         img = img2array(paths[i], desired_size=[512, 512], expand=True)
         imgs.append(torch.from_numpy(img))
-    imgs = Variable(torch.cat(imgs))
+    imgs = torch.cat(imgs)
     imgs = imgs.permute(0, 3, 1, 2)
 
     # loc = torch.Tensor(2, 2).uniform_(-1, 1)
-    loc = torch.from_numpy(np.array([[0., 0.], [0., 0.]]))
-    loc = Variable(loc)
+    loc = torch.from_numpy(np.array([[0., 0.], [0., 0.]], dtype='float32'))
 
-    ret = retina(g=64, k=3, s=2)
-    glimpse = ret.foveate(imgs, loc).data.numpy()
+    ret = retina(patch_size=64, num_patches=3, scale=2, img_shape=(512, 512))
+    glimpse = ret.foveate(imgs, loc).numpy()
 
+    # (batch, channel, num_patches, 64, 64) -> (batch, num_patches, 64, 64, channel)
     glimpse = np.reshape(glimpse, [2, 3, 3, 64, 64])
-    glimpse = np.transpose(glimpse, [0, 1, 3, 4, 2])
+    glimpse = np.transpose(glimpse, [0, 2, 3, 4, 1])
 
     merged = []
     for i in range(len(glimpse)):
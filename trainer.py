@@ -1,5 +1,8 @@
 from tqdm import tqdm
-from utils import AverageMeter
+import torch
+from utils import TensorMeter
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 import logging
 
 logger = logging.getLogger('RAM')
@@ -9,9 +12,27 @@ class Trainer(object):
     """
     Trainer encapsulates all the logic necessary for training.
     """
-    def __init__(self, model, optimizer, watch=[], val_watch=[]):
+    def __init__(self, model, optimizer, watch=[], val_watch=[], distributed=False, amp=False):
+        """
+        @param distributed: train with DistributedDataParallel, one process per GPU.
+        The process group must already be initialized and the current cuda device set.
+        The metrics are averaged over all the processes and the callbacks run on every
+        process, only the rank 0 process logs. Pass callbacks that write files to rank 0 only.
+        @param amp: run the training forward pass in bfloat16 mixed precision. Requires a GPU.
+        bfloat16 has the float32 exponent range, so no loss scaling is needed.
+        """
         self.model = model
         self.optimizer = optimizer
+        self.distributed = distributed
+        self.amp = amp
+        self.is_master = not distributed or dist.get_rank() == 0
+
+        # gradients are only synchronized in the training forward/backward,
+        # validation and test run on the plain model. The only buffers are
+        # the constant retina ones, no need to broadcast them every batch.
+        self.train_model = model
+        if distributed:
+            self.train_model = DistributedDataParallel(model, device_ids=[torch.cuda.current_device()], broadcast_buffers=False)
         self.stop_training = False
         self.watch = watch
         self.val_watch = val_watch
@@ -24,13 +45,16 @@ class Trainer(object):
         for epoch in range(start_epoch, epochs):
             if self.stop_training:
                 return
+            if self.distributed:
+                train_loader.sampler.set_epoch(epoch)
             epoch_log = self.train_one_epoch(epoch, train_loader, callbacks=callbacks)
             val_log = self.validate(epoch, val_loader)
 
-            msg = ' '.join(['{}: {:.3f}'.format(name, avg) for name, avg in epoch_log.items()])
-            logger.info(msg)
-            msg = ' '.join(['{}: {:.3f}'.format(name, avg) for name, avg in val_log.items()])
-            logger.info(msg)
+            if self.is_master:
+                msg = ' '.join(['{}: {:.3f}'.format(name, avg) for name, avg in epoch_log.items()])
+                logger.info(msg)
+                msg = ' '.join(['{}: {:.3f}'.format(name, avg) for name, avg in val_log.items()])
+                logger.info(msg)
             epoch_log.update(val_log)
 
             for cbk in callbacks:
@@ -40,52 +64,64 @@ class Trainer(object):
         """
         Train the model for 1 epoch of the training set.
         """
-        epoch_log = {name: AverageMeter() for name in self.watch}
+        epoch_log = {name: TensorMeter() for name in self.watch}
 
-        for i, (x, y) in enumerate(tqdm(train_loader, unit='batch', desc='Epoch {:>3}'.format(epoch))):
-            metric = self.model.forward(x, y, is_training=True)
+        for i, (x, y) in enumerate(tqdm(train_loader, unit='batch', desc='Epoch {:>3}'.format(epoch), disable=not self.is_master)):
+            with torch.autocast('cuda', dtype=torch.bfloat16, enabled=self.amp):
+                metric = self.train_model(x, y, is_training=True)
             loss = metric['loss']
-            for name, avg in epoch_log.items():
-                epoch_log[name].update(metric[name].data[0], x.size()[0])
+            # keep the running sums on device, no sync until the epoch ends
+            for name, meter in epoch_log.items():
+                meter.update(metric[name], x.size()[0])
 
-            self.optimizer.zero_grad()
+            self.optimizer.zero_grad(set_to_none=True)
             loss.backward()
             self.optimizer.step()
 
             for cbk in callbacks:
                 cbk.on_batch_end(epoch, i, logs=metric)
 
-        return {name: meter.avg for name, meter in epoch_log.items()}
+        return self.summarize(epoch_log)
 
+    @torch.no_grad()
     def validate(self, epoch, val_loader):
         """
         Evaluate the model on the validation set.
+        No autograd graph is recorded through the glimpse unroll.
         """
-        val_log = {name: AverageMeter() for name in self.watch}
+        val_log = {name: TensorMeter() for name in self.watch}
 
         for i, (x, y) in enumerate(val_loader):
             # metric = self.model.forward(x, y, is_training=False)
             metric = self.model.forward(x, y)
-            for name, avg in val_log.items():
-                val_log[name].update(metric[name].data[0], x.size()[0])
+            for name, meter in val_log.items():
+                meter.update(metric[name], x.size()[0])
+
+        return self.summarize(val_log, prefix='val_')
 
-        return {'val_'+name: meter.avg for name, meter in val_log.items()}
+    def summarize(self, log, prefix=''):
+        """
+        Average the meters of an epoch, over all the processes when distributed.
+        """
+        if self.distributed:
+            for meter in log.values():
+                meter.all_reduce()
+        return {prefix+name: meter.avg for name, meter in log.items()}
 
-    def test(self, test_loader, best=True):
+    @torch.no_grad()
+    def test(self, test_loader):
         """
         Test the model on the held-out test data.
         This function should only be called at the very
-        end once the model has finished training.
+        end once the model has finished training, with
+        the checkpoint to evaluate already loaded.
         """
-        # load the best checkpoint
-        self.load_checkpoint(best=best)
-
-        accs = AverageMeter()
+        accs = TensorMeter()
 
         for i, (x, y) in enumerate(test_loader):
             metric = self.model.forward(x, y)
             acc = metric['acc']
 
-            accs.update(acc.data[0], x.size()[0])
+            accs.update(acc, x.size()[0])
 
-        logger.info('Test Acc: {}/{} ({:.2f}%)'.format(accs.sum, accs.n, accs.avg))
+        logger.info('Test Acc: {:.2f}% on {} samples'.format(accs.avg, accs.count))
@@ -1,6 +1,8 @@
 import os
 import json
 import numpy as np
+import torch
+import torch.distributed as dist
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
@@ -20,26 +22,43 @@ def bounding_box(x, y, size, color='w'):
     return rect
 
 
-class AverageMeter(object):
+class TensorMeter(object):
     """
-    Computes and stores the average and
-    current value.
+    Computes the average of tensor values, keeping
+    the running sum on the device of the values.
+    Only reading `avg` syncs with the host.
     """
     def __init__(self):
         self.reset()
 
     @property
     def avg(self):
-        return self.sum / self.count
+        if self.count == 0:
+            raise ValueError('TensorMeter has no values to average')
+        return (self.sum / self.count).item()
 
     def reset(self):
-        self.sum = 0
+        self.sum = None
         self.count = 0
 
     def update(self, val, n=1):
-        self.sum += val * n
+        val = val.detach() * n
+        if self.sum is None:
+            self.sum = val
+        else:
+            self.sum += val
         self.count += n
 
+    def all_reduce(self):
+        """
+        Sum the meter over all the processes of the default process group,
+        so that every process reads the same average.
+        """
+        count = torch.tensor(float(self.count), device=self.sum.device)
+        dist.all_reduce(self.sum)
+        dist.all_reduce(count)
+        self.count = int(count.item())
+
 
 def resize_array(x, size):
     # 3D and 4D tensors allowed only